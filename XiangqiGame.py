@@ -3,6 +3,9 @@
 # Description: Fully functional Xiangqi Game.
 # Contains classes for game and each piece type.
 
+import sys
+
+
 class XiangqiGame:
     """Represents a game of Xiangqi. Keeps track of the board, game state, piece
     locations, 'check' status. Contains method to move pieces. Game ends when a
@@ -74,6 +77,11 @@ class XiangqiGame:
         # All columns and rows on board. Index of letter/number match board index
         self._columns = ["a", "b", "c", "d", "e", "f", "g", "h", "i"]
         self._rows = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]
+        # Board coordinates (row index, column index) of every space name
+        self._spaces = {}
+        for row in range(len(self._rows)):
+            for column in range(len(self._columns)):
+                self._spaces[self._columns[column] + self._rows[row]] = (row, column)
         self._game_state = "UNFINISHED"
         self._red_check = False
         self._black_check = False
@@ -105,15 +113,12 @@ class XiangqiGame:
         # Check game state and make sure moves are within board boundaries
         if self._game_state != "UNFINISHED":
             return False
-        elif current[0] not in self._columns or next[0] not in self._columns:
-            return False
-        elif current[1:] not in self._rows or next[1:] not in self._rows:
+        elif current not in self._spaces or next not in self._spaces:
             return False
 
         # Convert input move coordinates into tuples of (row index, column index)
-        # by using columns/rows lists to find board indexes
-        current = (self._rows.index(current[1:]), self._columns.index(current[0]))
-        next = (self._rows.index(next[1:]), self._columns.index(next[0]))
+        current = self._spaces[current]
+        next = self._spaces[next]
 
         # If attempted move is valid, change turn. If not, return False.
         if self.move_piece(current, next):
@@ -124,6 +129,69 @@ class XiangqiGame:
         else:
             return False
 
+        self.update_game_state()
+        return True  # Move completed successfully
+
+    def apply_moves(self, moves, trusted=True, verify_every=0):
+        """Makes a sequence of (current, next) moves, such as a recorded game.
+        Untrusted moves are made one at a time with make_move. Trusted moves
+        skip the legality and game over checks of each move, and the game
+        state is only updated once all moves are made. If verify_every is
+        set, every nth trusted move is still checked for legality to catch
+        corrupt records. Returns False at the first move that can't be made,
+        leaving the moves before it on the board."""
+        if not trusted:
+            for current, next in moves:
+                if not self.make_move(current, next):
+                    return False
+            return True
+
+        if self._game_state != "UNFINISHED":
+            return False
+
+        completed = True
+        ply = 0
+        for current, next in moves:
+            ply += 1
+            if current not in self._spaces or next not in self._spaces:
+                completed = False
+                break
+            current = self._spaces[current]
+            next = self._spaces[next]
+
+            if verify_every and ply % verify_every == 0:
+                # Sampled move: full legality check, game over check deferred
+                if not self.move_piece(current, next):
+                    completed = False
+                    break
+            else:
+                # Trusted move: only make sure player is moving own piece
+                current_piece = self._board[current[0]][current[1]]
+                if current_piece is None or \
+                        Piece.get_team(current_piece) != self._turn:
+                    completed = False
+                    break
+                next_piece = self._board[next[0]][next[1]]
+                self.update_board(current, next, current_piece, next_piece)
+
+            if self._turn == "red":
+                self._turn = "black"
+            else:
+                self._turn = "red"
+
+        if ply > 0:
+            # Update check status of player who moved last, then evaluate
+            # the game state for the player whose turn it is
+            if self._turn == "red":
+                self.is_in_check("black")
+            else:
+                self.is_in_check("red")
+            self.update_game_state()
+        return completed
+
+    def update_game_state(self):
+        """Updates the check status of the player whose turn it is, and ends
+        the game if that player cannot make any valid moves."""
         # Update check status of opposing player after valid move is made
         self.is_in_check(self._turn)
 
@@ -142,8 +210,6 @@ class XiangqiGame:
                 else:
                     self._game_state = "STALEMATE: RED WON!"
 
-        return True  # Move completed successfully
-
     def move_piece(self, current, next):
         """Takes the board coordinates of an attempted move, determines if
         the move is valid and doesn't place the moving player in check."""
@@ -656,45 +722,416 @@ class Soldier(Piece):
                 self._possible_moves.append((self._space[0], self._space[1] - 1))
 
 
+class NodeLimitError(Exception):
+    """Raised when a MateSolver search goes over its node limit"""
+    pass
+
+
+class MateSolver:
+    """Solves mate-in-N puzzles for the player whose turn it is in a Xiangqi
+    game, using depth-first proof-number search. The attacker may only make
+    checking moves, the defender may make any valid move. Positions already
+    searched are kept in a bounded table."""
+
+    INFINITY = 10 ** 9
+    COLUMNS = "abcdefghi"
+
+    def __init__(self, game, table_size=1000000, max_nodes=None):
+        """Initializes the solver for a game, the size limit of the table of
+        searched positions, the limit of positions searched per solve (None
+        for no limit), and the results of the last solve."""
+        if table_size < 1:
+            raise ValueError("table_size must be at least 1")
+        self._game = game
+        self._table_size = table_size
+        self._table = {}
+        self._path = set()  # Keys of positions on the current search path
+        self._moves = []  # (current, next, captured) of moves made on the board
+        self._attacker = game.get_turn()
+        self._max_nodes = max_nodes
+        self._nodes = 0
+        self._solved = False
+        self._mate_length = None
+        self._line = []
+        self._key_moves = []
+
+    def get_mate_length(self):
+        """Returns the number of attacker moves in the mate found by the last
+        solve, or None if no mate was found"""
+        return self._mate_length
+
+    def get_line(self):
+        """Returns the mating line found by the last solve as a list of
+        (current, next) moves, with the longest defense at each reply"""
+        return self._line
+
+    def get_key_moves(self):
+        """Returns every first move that mates in the number of moves found
+        by the last solve"""
+        return self._key_moves
+
+    def is_unique(self):
+        """Returns whether the last solve found exactly one key move"""
+        return len(self._key_moves) == 1
+
+    def is_solved(self):
+        """Returns whether the last solve finished within the node limit. If
+        not, no mate was reported even though one may exist."""
+        return self._solved
+
+    def get_node_count(self):
+        """Returns the number of positions searched by the last solve"""
+        return self._nodes
+
+    def solve(self, depth):
+        """Searches for a forced mate in at most 'depth' moves by the player
+        whose turn it is. Finds the shortest mate, its mating line and all
+        key moves. Returns the mating line, or None if there is no such mate.
+        The game is left as it was found."""
+        # Searched positions are stored relative to the attacker, so they
+        # can only be reused while the same player is attacking
+        if self._game.get_turn() != self._attacker:
+            self._table = {}
+            self._attacker = self._game.get_turn()
+        self._nodes = 0
+        self._path = set()
+        self._moves = []
+        self._solved = False
+        self._mate_length = None
+        self._line = []
+        self._key_moves = []
+        if self._game.get_game_state() != "UNFINISHED" or depth < 1:
+            self._solved = True
+            return None
+
+        # Searching reorders the active piece lists, so they are restored after
+        rpieces = list(self._game.get_rpieces())
+        bpieces = list(self._game.get_bpieces())
+
+        try:
+            self._mate_length = self.find_mate_length(self._attacker, depth)
+            if self._mate_length is not None:
+                defender = self.other_team(self._attacker)
+                for current, next in self.generate_moves(self._attacker, True):
+                    self.make(current, next)
+                    if self.find_mate_length(defender, self._mate_length - 1) is not None:
+                        self._key_moves.append((self.space_name(current),
+                                                self.space_name(next)))
+                    self.unmake()
+                self._line = self.find_line()
+            self._solved = True
+        except NodeLimitError:
+            self._mate_length = None
+            self._line = []
+            self._key_moves = []
+        finally:
+            # Take back any moves left on the board if the search was stopped
+            while self._moves:
+                self.unmake()
+            self._game.get_rpieces()[:] = rpieces
+            self._game.get_bpieces()[:] = bpieces
+            self._game.is_in_check("red")
+            self._game.is_in_check("black")
+
+        if self._mate_length is None:
+            return None
+        return self._line
+
+    def find_mate_length(self, turn, depth):
+        """Returns the fewest attacker moves, up to 'depth', in which the
+        attacker can force mate from the current position, or None. Turn is
+        the player to move, the attacker or the defender."""
+        attacking = turn == self._attacker
+        if attacking:
+            length = 1
+        else:
+            length = 0
+        while length <= depth:
+            key = (self.position_key(turn), length)
+            phi, delta = self.search(key, turn, length, self.INFINITY, self.INFINITY)
+            # Attacker's node is proven when phi is 0, defender's when delta is 0
+            if (attacking and phi == 0) or (not attacking and delta == 0):
+                return length
+            length += 1
+        return None
+
+    def find_line(self):
+        """Returns the mating line, where the attacker always picks the
+        shortest mate and the defender the longest defense."""
+        line = []
+        turn = self._attacker
+        depth = self._mate_length
+        while True:
+            best = None
+            if turn == self._attacker:
+                moves = self.generate_moves(turn, True)
+            else:
+                moves = self.generate_moves(turn, False)
+            for current, next in moves:
+                self.make(current, next)
+                if turn == self._attacker:
+                    length = self.find_mate_length(self.other_team(turn), depth - 1)
+                    if length is not None and (best is None or length < best[0]):
+                        best = (length, current, next)
+                else:
+                    length = self.find_mate_length(self.other_team(turn), depth)
+                    if length is not None and (best is None or length > best[0]):
+                        best = (length, current, next)
+                self.unmake()
+            if best is None:  # Defender has no valid moves: checkmate
+                break
+            depth, current, next = best
+            line.append((self.space_name(current), self.space_name(next)))
+            self.make(current, next)
+            turn = self.other_team(turn)
+
+        # Take back the line to restore the starting position
+        for move in line:
+            self.unmake()
+        return line
+
+    def search(self, key, turn, depth, th_phi, th_delta):
+        """Depth-first proof-number search of a position until its proof or
+        disproof numbers reach the given thresholds. Phi and delta are the
+        proof and disproof numbers of the attacker's positions, and the
+        disproof and proof numbers of the defender's positions. Returns the
+        (phi, delta) of the position."""
+        self._nodes += 1
+        if self._max_nodes is not None and self._nodes > self._max_nodes:
+            raise NodeLimitError("searched more than %d positions" % self._max_nodes)
+
+        attacking = turn == self._attacker
+        if attacking:
+            child_depth = depth - 1
+        else:
+            child_depth = depth
+            # No attacker moves left: proven only if defender cannot move
+            if depth == 0:
+                if self.generate_moves(turn, False, first_only=True):
+                    result = (0, self.INFINITY)
+                else:
+                    result = (self.INFINITY, 0)
+                self.store(key, result[0], result[1])
+                return result
+
+        children = self.generate_moves(turn, attacking, child_depth)
+        # Attacker without checks, or defender in checkmate, loses
+        if not children:
+            self.store(key, self.INFINITY, 0)
+            return (self.INFINITY, 0)
+
+        # Last known (phi, delta) of each child, used if the table dropped it
+        values = [self.lookup(child[2]) for child in children]
+        self._path.add(key)
+        while True:
+            phi = self.INFINITY
+            second = self.INFINITY
+            delta = 0
+            best = None
+            for index in range(len(children)):
+                values[index] = self._table.get(children[index][2], values[index])
+                child_phi, child_delta = values[index]
+                delta = min(self.INFINITY, delta + child_phi)
+                if child_delta < phi:
+                    second = phi
+                    phi = child_delta
+                    best = index
+                elif child_delta < second:
+                    second = child_delta
+            if phi >= th_phi or delta >= th_delta:
+                self._path.discard(key)
+                self.store(key, phi, delta)
+                return (phi, delta)
+
+            current, next, child_key = children[best]
+            child_phi = values[best][0]
+            self.make(current, next)
+            values[best] = self.search(child_key, self.other_team(turn), child_depth,
+                                       th_delta - delta + child_phi,
+                                       min(th_phi, second + 1))
+            self.unmake()
+
+    def generate_moves(self, team, checks_only, child_depth=None, first_only=False):
+        """Returns a list of (current, next) for every valid move of a team.
+        If child_depth is given, the table key of the position after each
+        move is included, as (current, next, child key). If checks_only, only
+        moves that put the opponent in check are included. If first_only,
+        stops after the first valid move."""
+        board = self._game.get_board()
+        opponent = self.other_team(team)
+        if team == "red":
+            pieces = self._game.get_rpieces()
+        else:
+            pieces = self._game.get_bpieces()
+
+        moves = []
+        for piece in list(pieces):
+            current = Piece.get_space(piece)
+            for next in list(Piece.get_moves(piece, board)):
+                # Skip moves off the board or onto team's own piece
+                if not (0 <= next[0] < 10 and 0 <= next[1] < 9):
+                    continue
+                next_piece = board[next[0]][next[1]]
+                if next_piece is not None and Piece.get_team(next_piece) == team:
+                    continue
+
+                self.make(current, next)
+                if not self._game.is_in_check(team):
+                    if not checks_only or self._game.is_in_check(opponent):
+                        if child_depth is None:
+                            moves.append((current, next))
+                        else:
+                            moves.append((current, next,
+                                          (self.position_key(opponent), child_depth)))
+                self.unmake()
+                if first_only and moves:
+                    return moves
+        return moves
+
+    def make(self, current, next):
+        """Moves a piece on the board and records the move so it can be
+        taken back"""
+        board = self._game.get_board()
+        captured = board[next[0]][next[1]]
+        self._moves.append((current, next, captured))
+        self._game.update_board(current, next, board[current[0]][current[1]], captured)
+
+    def unmake(self):
+        """Takes back the last move made with make"""
+        current, next, captured = self._moves.pop()
+        board = self._game.get_board()
+        self._game.revert_board(current, next, board[next[0]][next[1]], captured)
+
+    def lookup(self, key):
+        """Returns the (phi, delta) of a searched position. Positions not yet
+        searched count as (1, 1)."""
+        return self._table.get(key, (1, 1))
+
+    def store(self, key, phi, delta):
+        """Stores the (phi, delta) of a position. When the table is full, the
+        least recently stored position not on the current search path is
+        dropped."""
+        if key in self._table:
+            del self._table[key]
+        elif len(self._table) >= self._table_size:
+            for old in self._table:
+                if old not in self._path:
+                    del self._table[old]
+                    break
+        self._table[key] = (phi, delta)
+
+    def position_key(self, turn):
+        """Returns a hashable key of the board and the player to move"""
+        key = [turn]
+        for row in self._game.get_board():
+            for piece in row:
+                if piece is None:
+                    key.append(None)
+                else:
+                    key.append(Piece.get_team(piece)[0] + Piece.get_type(piece))
+        return tuple(key)
+
+    def other_team(self, team):
+        """Returns the opposing team"""
+        if team == "red":
+            return "black"
+        return "red"
+
+    def space_name(self, space):
+        """Converts a (row index, column index) space into its name, ex. 'a1'"""
+        return self.COLUMNS[space[1]] + str(space[0] + 1)
+
+
 class Board:
-    """Class for displaying the Xiangqi game board"""
+    """Class for displaying the Xiangqi game board. Each frame is built in a
+    single buffer and written to the output stream at once."""
+
+    def __init__(self, color=True, diff=False, stream=None):
+        """Initializes the display options. Color uses colorama to color the
+        board, plain mode (color=False) is meant for piped output. Diff mode
+        uses ANSI cursor addressing to redraw only the squares that changed
+        since the last frame. Stream defaults to stdout."""
+        if color:
+            from colorama import Fore, Back, Style
+            self._frame_color = Fore.YELLOW
+            self._river_color = Fore.YELLOW + Back.BLUE
+            self._empty_color = Fore.WHITE + Back.YELLOW
+            self._team_colors = {"r": Fore.RED + Back.YELLOW,
+                                 "b": Fore.LIGHTBLUE_EX + Back.YELLOW}
+            self._reset = Style.RESET_ALL
+        else:
+            self._frame_color = ""
+            self._river_color = ""
+            self._empty_color = ""
+            self._team_colors = {"r": "", "b": ""}
+            self._reset = ""
+        self._diff = diff
+        self._stream = stream
+        self._last_cells = None  # Cells of the last frame drawn in diff mode
 
     def display_board(self, board):
-        """Displays the current state of the board in color"""
-        from colorama import Fore, Back, Style
+        """Displays the current state of the board. In diff mode, only the
+        squares that changed since the previous call are redrawn."""
+        cells = [[self.render_cell(piece) for piece in row] for row in board]
+        if not self._diff:
+            frame = self.render_frame(cells)
+        elif self._last_cells is None:
+            # Clear screen and home cursor so squares can be addressed later
+            frame = "\033[H\033[2J" + self.render_frame(cells)
+        else:
+            frame = self.render_changes(cells)
+        if self._diff:
+            self._last_cells = cells
+
+        stream = self._stream
+        if stream is None:
+            stream = sys.stdout
+        stream.write(frame)
+        stream.flush()
+
+    def render_cell(self, piece):
+        """Returns the text for a single board square"""
+        if piece is None:
+            return self._empty_color + "[  ] " + self._reset
+        team = piece.get_team()[0]
+        return (self._team_colors[team] + "[" + team.upper() +
+                piece.get_type() + "] " + self._reset)
+
+    def render_frame(self, cells):
+        """Returns the text of the whole board from the rendered squares"""
+        border = (self._frame_color +
+                  "   --a----b----c----d----e----f----g----h----i--" +
+                  self._reset + "\n")
+        lines = [border]
         index = 1
-        print(Fore.YELLOW + "   --a----b----c----d----e----f----g----h----i--"
-              + Style.RESET_ALL)
-        for row in board:
+        for row in cells:
             if index == 6:
-                print("  ", Fore.YELLOW + Back.BLUE +
-                      "~~~~~~~~~~~~~~~~~~~~RIVER~~~~~~~~~~~~~~~~~~~~" +
-                      Style.RESET_ALL)
-            if index == 10:
-                print(Fore.YELLOW + str(index) + "|", end="" + Style.RESET_ALL)
-            else:
-                print(Fore.YELLOW + " " + str(index) + "|",
-                      end="" + Style.RESET_ALL)
-            for i in range(len(row)):
-                if row[i] == None:
-                    print(Fore.WHITE + Back.YELLOW + "[  ]",
-                          end=" " + Style.RESET_ALL)
-                else:
-                    columns = 1
-                    team = row[i].get_team()[0]
-                    type = row[i].get_type()
-                    piece = team.upper() + type
-                    if team == "r":
-                        print(Fore.RED + Back.YELLOW +
-                              "[" + piece + "]", end=" " + Style.RESET_ALL)
-                    elif team == "b":
-                        print(Fore.LIGHTBLUE_EX + Back.YELLOW +
-                              "[" + piece + "]", end=" " + Style.RESET_ALL)
-                    columns += 1
-            print(Fore.YELLOW + "|" + str(index) + Style.RESET_ALL)
+                lines.append("   " + self._river_color +
+                             "~~~~~~~~~~~~~~~~~~~~RIVER~~~~~~~~~~~~~~~~~~~~" +
+                             self._reset + "\n")
+            lines.append(self._frame_color + str(index).rjust(2) + "|" +
+                         self._reset)
+            lines.extend(row)
+            lines.append(self._frame_color + "|" + str(index) +
+                         self._reset + "\n")
             index += 1
-        print(Fore.YELLOW + "   --a----b----c----d----e----f----g----h----i--"
-              + Style.RESET_ALL)
+        lines.append(border)
+        return "".join(lines)
+
+    def render_changes(self, cells):
+        """Returns ANSI cursor-addressed text that redraws only the squares
+        that differ from the last frame, then moves the cursor below the
+        board and clears anything printed after the previous frame."""
+        changes = []
+        for row in range(len(cells)):
+            # Terminal lines are 1-indexed: border on line 1, river after row 5
+            line = row + 2 if row < 5 else row + 3
+            for column in range(len(cells[row])):
+                if cells[row][column] != self._last_cells[row][column]:
+                    changes.append("\033[%d;%dH" % (line, 4 + 5 * column))
+                    changes.append(cells[row][column])
+        changes.append("\033[%d;1H\033[J" % (len(cells) + 4))
+        return "".join(changes)
 
 
 class Play:
@@ -705,8 +1142,10 @@ class Play:
         asks for player to move a piece, and makes the move if valid. Ends when a player
         wins the game via Checkmate or Stalemate"""
         game = XiangqiGame()
+        # Plain output when piped, so the log is free of color codes
+        board = Board(color=sys.stdout.isatty())
         while game.get_game_state() == "UNFINISHED":
-            Board().display_board(game.get_board())
+            board.display_board(game.get_board())
             if game.is_in_check(game.get_turn()):
                 print(game.get_turn().upper(), "is in check")
             print(game.get_turn().upper(), "MOVE")
@@ -715,5 +1154,5 @@ class Play:
             next = str(input("Enter the space you would like to move to (ex., 'a1'): "))
             if not game.make_move(current, next):
                 print("Invalid Move")
-        Board().display_board(game.get_board())
+        board.display_board(game.get_board())
         print(game.get_game_state())
\ No newline at end of file